@@ -4,17 +4,28 @@ Backend.py
 OpenAI Agents SDK + Flask + Proper Session Management
 """
 
-from flask import Flask, request, jsonify, send_file, session
+from flask import Flask, request, jsonify, send_file, session, Response, stream_with_context
 from flask_cors import CORS
 import pandas as pd
 import os
+import re
 from datetime import datetime, timedelta
 import asyncio
+import logging
+import threading
 
 # Import the HR Agent system
 from hr_agent_sdk_openai import HRAgentSystem
+from hr_agent_core import find_employee
 from w2_generator import W2Generator
 
+# Agent modules log per-turn detail at DEBUG; set LOG_LEVEL=DEBUG to see it
+logging.basicConfig(
+    level=os.environ.get('LOG_LEVEL', 'INFO').upper(),
+    format='%(asctime)s %(levelname)s %(name)s: %(message)s'
+)
+logger = logging.getLogger(__name__)
+
 # ================================================================
 # INITIALIZE FLASK APP
 # ================================================================
@@ -53,12 +64,27 @@ except:
     # Fallback if file doesn't exist
     print("⚠️  Warning: hr_emails.csv not found, using empty dataframe")
     hr_emails_df = pd.DataFrame(columns=['Employee Name', 'Email', 'Subject', 'Category', 'Priority', 'Status', 'Date Received', 'Response Due', 'Message'])
-health_plans_df = pd.read_csv(HEALTH_PLANS_CSV)
+try:
+    health_plans_df = pd.read_csv(HEALTH_PLANS_CSV)
+except FileNotFoundError:
+    # The agent answers plan questions with "not available" instead
+    print("⚠️  Warning: health_plans.csv not found, health plan tool disabled")
+    health_plans_df = None
+
+# Compact dtypes for the read-only employee table: smallest integer types
+# that hold the counts, categories for low-cardinality labels. Bonus % stays
+# float64 so the stored decimals are not rounded.
+for column in ('Salary', 'Days Off Remaining', 'Days Off'):
+    if column in employees_df.columns:
+        employees_df[column] = pd.to_numeric(employees_df[column], downcast='unsigned')
+for column in ('Gender', 'Senior Management', 'Team', 'Location', 'On-site'):
+    if column in employees_df.columns:
+        employees_df[column] = employees_df[column].astype('category')
 
 print(f"✓ Loaded {len(employees_df)} employees")
 print(f"✓ Loaded {len(hr_tickets_df)} tickets")
 print(f"✓ Loaded {len(hr_emails_df)} emails")
-print(f"✓ Loaded {len(health_plans_df)} health plans")
+print(f"✓ Loaded {0 if health_plans_df is None else len(health_plans_df)} health plans")
 
 # ================================================================
 # INITIALIZE HR AGENT SYSTEM
@@ -69,8 +95,31 @@ hr_agent_system = HRAgentSystem(
     health_plans_df=health_plans_df
 )
 
+# The agent's AsyncOpenAI client pools connections on the event loop that
+# first uses it, so every request runs on this one long-lived loop rather
+# than a fresh asyncio.run() loop per request.
+agent_loop = asyncio.new_event_loop()
+threading.Thread(target=agent_loop.run_forever, name='hr-agent-loop', daemon=True).start()
+
 print("✅ HR Agent System ready")
 
+
+# Email draft parts in an agent reply: To:, Subject:, and the body
+# (everything after Subject: until the next section or the end)
+_DRAFT_TO_RE = re.compile(r'To:\s*([^\n]+)')
+_DRAFT_SUBJECT_RE = re.compile(r'Subject:\s*([^\n]+)')
+_DRAFT_BODY_RE = re.compile(r'Subject:[^\n]+\n+(.*?)(?:\n\n---|\n\nBest regards|$)', re.DOTALL)
+
+
+def employee_record(identifier):
+    """Full employees.csv row for an employee ID or first name, or None"""
+    # Resolved through the agent's prebuilt indexes instead of scanning the DataFrame
+    employee = find_employee(hr_agent_system.context, identifier)
+    if employee is None:
+        return None
+    return employees_df.iloc[employee.row].to_dict()
+
+
 # Initialize W-2 generator
 try:
     w2_output_dir = '/tmp/tax_documents' if os.path.exists('/tmp') else os.path.expanduser('~/Desktop/tax_documents')
@@ -121,12 +170,14 @@ def ask_question():
                 'error': 'Missing question or employee identifier'
             }), 400
         
-        print(f"📥 Question from employee {identifier}: {question}")
+        logger.debug("Question from employee %s: %s", identifier, question)
         
-        # Call async method using asyncio.run()
-        result = asyncio.run(hr_agent_system.chat(identifier, question))
+        # Run the async chat on the shared agent loop and wait for the reply
+        result = asyncio.run_coroutine_threadsafe(
+            hr_agent_system.chat(identifier, question), agent_loop
+        ).result()
         
-        print(f"✅ Response: {result['response'][:100]}...")
+        logger.debug("Response: %.100s", result['response'])
         
         # Parse email draft from agent response if present
         response_text = result.get('response', '')
@@ -134,14 +185,9 @@ def ask_question():
         # Check if response contains an email draft
         if ('email draft' in response_text.lower() or 'draft i prepared' in response_text.lower()):
             # Try to extract email components using simple parsing
-            import re
-            
-            # Look for To:, Subject:, and message body patterns
-            to_match = re.search(r'To:\s*([^\n]+)', response_text)
-            subject_match = re.search(r'Subject:\s*([^\n]+)', response_text)
-            
-            # Extract the body (everything after Subject: until next section or end)
-            body_match = re.search(r'Subject:[^\n]+\n+(.*?)(?:\n\n---|\n\nBest regards|$)', response_text, re.DOTALL)
+            to_match = _DRAFT_TO_RE.search(response_text)
+            subject_match = _DRAFT_SUBJECT_RE.search(response_text)
+            body_match = _DRAFT_BODY_RE.search(response_text)
             
             if to_match and subject_match:
                 result['email_draft'] = {
@@ -150,39 +196,26 @@ def ask_question():
                     'body': body_match.group(1).strip() if body_match else ''
                 }
                 result['show_email_buttons'] = True
-                print(f"📧 Email draft detected and structured")
+                logger.debug("Email draft detected and structured")
         
         # Check if this is a W-2 request
         response_lower = result.get('response', '').lower()
         if 'w-2' in response_lower or 'w2' in response_lower:
             if w2_gen:
                 try:
-                    employee_row = None
-                    if identifier.startswith('EID'):
-                        match = employees_df[employees_df['Employee ID'].astype(str).str.strip() == identifier]
-                        if not match.empty:
-                            employee_row = match.iloc[0]
-                    else:
-                        match = employees_df[employees_df['First Name'].astype(str).str.strip().str.lower() == identifier.lower()]
-                        if not match.empty:
-                            employee_row = match.iloc[0]
-                    
-                    if employee_row is not None:
-                        employee_data = employee_row.to_dict()
+                    employee_data = employee_record(identifier)
+                    if employee_data is not None:
                         pdf_path = w2_gen.generate_w2(employee_data)
                         result['w2_path'] = pdf_path
                         result['w2_download_url'] = f'/api/download-w2/{identifier}'
                 except Exception as e:
-                    print(f"W-2 generation error: {e}")
+                    logger.error("W-2 generation error: %s", e)
                     result['w2_error'] = str(e)
         
         return jsonify(result)
     
     except Exception as e:
-        import traceback
-        error_trace = traceback.format_exc()
-        print(f"❌ ERROR in ask endpoint:")
-        print(error_trace)
+        logger.exception("ERROR in ask endpoint")
         
         return jsonify({
             'success': False,
@@ -191,6 +224,52 @@ def ask_question():
         }), 500
 
 
+@app.route('/api/ask/stream', methods=['POST', 'OPTIONS'])
+def ask_question_stream():
+    """Chat endpoint that streams the reply as plain text while it is generated
+    
+    Plain text only: the email-draft and W-2 extras that /api/ask attaches
+    to its JSON reply are not produced here. With no Send Email button, a
+    "yes" after a draft is left to the model.
+    """
+    if request.method == 'OPTIONS':
+        return '', 200
+    
+    try:
+        data = request.get_json()
+        question = data.get('question', '').strip()
+        identifier = str(data.get('employee_id', '')) or str(data.get('first_name', ''))
+    except Exception as e:
+        logger.debug("Bad ask stream request: %s", e)
+        question = identifier = ''
+    
+    if not question or not identifier:
+        return jsonify({
+            'success': False,
+            'error': 'Missing question or employee identifier'
+        }), 400
+    
+    logger.debug("Streaming question from employee %s: %s", identifier, question)
+    
+    def generate():
+        # Pull each chunk from the agent loop as soon as it is produced
+        chunks = hr_agent_system.chat_stream(identifier, question, draft_buttons=False)
+        try:
+            while True:
+                try:
+                    yield asyncio.run_coroutine_threadsafe(chunks.__anext__(), agent_loop).result()
+                except StopAsyncIteration:
+                    break
+        except Exception:
+            logger.exception("ERROR in ask stream")
+            yield 'I apologize, but I encountered an error. Please try again.'
+        finally:
+            # Release the conversation lock if the client disconnected early
+            asyncio.run_coroutine_threadsafe(chunks.aclose(), agent_loop).result()
+    
+    return Response(stream_with_context(generate()), mimetype='text/plain')
+
+
 @app.route('/api/download-w2/<employee_id>', methods=['GET'])
 def download_w2(employee_id):
     """Download W-2 PDF"""
@@ -198,20 +277,10 @@ def download_w2(employee_id):
         return jsonify({'error': 'W-2 generator not available'}), 500
     
     try:
-        employee_row = None
-        if employee_id.startswith('EID'):
-            match = employees_df[employees_df['Employee ID'].astype(str).str.strip() == employee_id]
-            if not match.empty:
-                employee_row = match.iloc[0]
-        else:
-            match = employees_df[employees_df['First Name'].astype(str).str.strip().str.lower() == employee_id.lower()]
-            if not match.empty:
-                employee_row = match.iloc[0]
-        
-        if employee_row is None:
+        employee_data = employee_record(employee_id)
+        if employee_data is None:
             return jsonify({'error': 'Employee not found'}), 404
         
-        employee_data = employee_row.to_dict()
         first_name = employee_data.get('First Name', 'Unknown')
         
         pdf_path = os.path.join(w2_gen.output_dir, f'{first_name}_W2_2024.pdf')
@@ -0,0 +1,361 @@
+"""
+HR Agent - CORE DATA ACCESS AND TOOLS
+==========================================================
+Employee lookup and tool implementations shared by the agent entry points.
+"""
+
+from __future__ import annotations
+
+import functools
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Optional
+
+if TYPE_CHECKING:  # only annotations use pandas; callers pass the DataFrames in
+    import pandas as pd
+
+try:
+    import orjson
+
+    def json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode()
+
+    json_loads = orjson.loads
+except ImportError:
+    import json
+
+    json_dumps = json.dumps
+    json_loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+# Constant replies, encoded once
+_ERR_NOT_FOUND = json_dumps({'success': False, 'error': 'Employee not found'})
+_ERR_UNKNOWN_FUNCTION = json_dumps({'success': False, 'error': 'Unknown function'})
+_ERR_NO_PLANS = json_dumps({'success': False, 'error': 'Health plans data not available'})
+
+# Casefolded "EID2480002"-style employee IDs
+_EID_RE = re.compile(r'eid\d+')
+
+# Email drafts, filled in with str.format
+_HR_ESCALATION_TPL = """Dear HR Team,
+
+Employee: {name} (ID: {eid})
+Subject: {subject}
+
+REQUEST DETAILS:
+{reason}
+
+This request has been escalated for your review and assistance.
+
+Best regards,
+HR Assistant Bot"""
+
+_MANAGER_EMAIL_TPL = """To: {manager}
+From: {name}
+Subject: {subject}
+
+{message}
+
+Best regards,
+{name}"""
+
+_HR_MEETING_TPL = """Dear HR Team,
+
+MEETING REQUEST
+Employee: {name} (ID: {eid})
+
+REASON FOR MEETING:
+{reason}
+
+Please send a calendar invitation to schedule a meeting time with this employee.
+
+Best regards,
+HR Assistant Bot"""
+
+# ================================================================
+# DATA ACCESS
+# ================================================================
+
+@dataclass(slots=True)
+class Employee:
+    """The fields the tools read for one employee, resolved once at load"""
+    row: int                      # position in the source DataFrame
+    employee_id: Optional[str]
+    first_name: Optional[str]
+    employee_name: Optional[str]
+    display_name: str             # name used in tool replies
+    salary: Any
+    pto: Any
+    manager: Any
+    # Replies of the per-employee read-only tools, encoded once at load
+    salary_json: str = field(default='', repr=False)
+    pto_json: str = field(default='', repr=False)
+
+
+# Alternate column names seen in other exports -> the names the tools read
+_EMPLOYEE_ALIASES = {
+    'Days Off': 'Days Off Remaining',
+    'Manager Name': 'Manager',
+}
+_PLAN_ALIASES = {
+    'Employee Monthly Cost': 'Monthly Cost Employee',
+    'Family Monthly Cost': 'Monthly Cost Family',
+    'Deductible': 'Deductible Individual',
+}
+
+
+def _with_aliases(df: pd.DataFrame, aliases: dict) -> pd.DataFrame:
+    """Rename alternate columns to their canonical names, unless the canonical column exists"""
+    renames = {old: new for old, new in aliases.items() if old in df.columns and new not in df.columns}
+    return df.rename(columns=renames) if renames else df
+
+
+def _plan_summaries(health_plans_df: pd.DataFrame) -> list:
+    """Health plan rows in the shape get_health_insurance_plans replies with"""
+    return [
+        {
+            'name': plan.get('Plan Name', 'Unknown'),
+            'type': plan.get('Plan Type', 'Unknown'),
+            'employee_cost': plan.get('Monthly Cost Employee', 'Unknown'),
+            'family_cost': plan.get('Monthly Cost Family', 'Unknown'),
+            'deductible_individual': plan.get('Deductible Individual', 'Unknown'),
+            'deductible_family': plan.get('Deductible Family', 'Unknown'),
+            'oop_max_individual': plan.get('Out of Pocket Max Individual', 'Unknown'),
+            'oop_max_family': plan.get('Out of Pocket Max Family', 'Unknown'),
+            'coverage_details': plan.get('Coverage Details', 'Unknown')
+        }
+        for plan in _with_aliases(health_plans_df, _PLAN_ALIASES).to_dict(orient='records')
+    ]
+
+
+class HRContext:
+    """In-memory copy of the HR data the tools read, built once at startup"""
+
+    __slots__ = ('employees', 'health_plans_json', '_by_id', '_by_number', '_by_name', '_by_full_name')
+
+    def __init__(self, employees_df: pd.DataFrame, health_plans_df: Optional[pd.DataFrame]):
+        employees_df = _with_aliases(employees_df, _EMPLOYEE_ALIASES)
+
+        # Plain lists rather than ndarrays so values come back as native
+        # Python scalars for json_dumps. Blank cells (NaN to pandas) become
+        # the default too, so the fallbacks and index guards below see them.
+        def column(name, default=None):
+            if name in employees_df.columns:
+                values = employees_df[name]
+                return values.astype(object).where(values.notna(), default).tolist()
+            return [default] * len(employees_df)
+
+        self.employees = [
+            Employee(row, employee_id, first, full, first or full or 'Unknown', salary, pto, manager)
+            for row, (employee_id, first, full, salary, pto, manager) in enumerate(zip(
+                column('Employee ID'),
+                column('First Name'),
+                column('Employee Name'),
+                column('Salary', 'Unknown'),
+                column('Days Off Remaining', 'Unknown'),
+                column('Manager', 'John Smith'),  # Default to John Smith for demo
+            ))
+        ]
+
+        # Plans never change while the server runs: serialize the reply once
+        if health_plans_df is None:
+            self.health_plans_json = _ERR_NO_PLANS
+        else:
+            self.health_plans_json = json_dumps({'success': True, 'plans': _plan_summaries(health_plans_df)})
+
+        # The data never changes while the server runs, so the replies that
+        # depend only on the employee are encoded up front
+        for employee in self.employees:
+            employee.salary_json = json_dumps({'success': True, 'salary': employee.salary})
+            employee.pto_json = json_dumps({'success': True, 'pto_remaining': employee.pto})
+
+        # Hash indexes: casefolded key -> Employee (first match wins)
+        self._by_id = {}
+        self._by_number = {}     # "2480002" for EID2480002
+        self._by_name = {}       # first name
+        self._by_full_name = {}  # Employee Name, when the data has it
+        for employee in self.employees:
+            if employee.employee_id is not None:
+                key = str(employee.employee_id).strip().casefold()
+                self._by_id.setdefault(key, employee)
+                number = key.removeprefix('eid')
+                if number.isdigit():
+                    self._by_number.setdefault(number, employee)
+            if employee.first_name is not None:
+                self._by_name.setdefault(str(employee.first_name).strip().casefold(), employee)
+            if employee.employee_name is not None:
+                self._by_full_name.setdefault(str(employee.employee_name).strip().casefold(), employee)
+
+    def canonical_id(self, key: str) -> Optional[str]:
+        """The Employee ID for any identifier find_employee accepts, or None"""
+        employee = find_employee(self, key)
+        if employee is None or employee.employee_id is None:
+            return None
+        return str(employee.employee_id)
+
+
+def find_employee(context: HRContext, employee_id: str) -> Optional[Employee]:
+    """Find employee by ID, bare ID number, first name or full name"""
+    key = employee_id.strip().casefold()
+    # Classify the key once, then probe only the index it can be in
+    if _EID_RE.fullmatch(key):
+        return context._by_id.get(key)
+    if key.isdigit():
+        return context._by_number.get(key)
+    employee = context._by_name.get(key)
+    if employee is None:
+        employee = context._by_full_name.get(key)
+    if employee is None:
+        employee = context._by_id.get(key)  # IDs in some other format
+    return employee
+
+
+# ================================================================
+# TOOLS
+# ================================================================
+
+def _lookup(arguments: dict, context: HRContext, session_employee: Optional[Employee]) -> Optional[Employee]:
+    """The employee a tool call refers to; the session's own employee needs no lookup"""
+    employee_id = arguments['employee_id']
+    if session_employee is not None and employee_id == session_employee.employee_id:
+        return session_employee
+    return find_employee(context, employee_id)
+
+
+def _employee_tool(tool):
+    """Look up arguments['employee_id'] and pass the record to the tool; unknown employees get the not-found reply"""
+    @functools.wraps(tool)
+    def wrapper(arguments: dict, context: HRContext, session_employee: Optional[Employee]) -> str:
+        employee = _lookup(arguments, context, session_employee)
+        if employee is None:
+            return _ERR_NOT_FOUND
+        return tool(arguments, context, employee)
+    return wrapper
+
+
+def _resolve_identity(arguments: dict, context: HRContext, session_employee: Optional[Employee]) -> tuple:
+    """(name, ID) to show HR; requests from unknown employees still go through"""
+    employee = _lookup(arguments, context, session_employee)
+    if employee is None:
+        return 'Unknown Employee', arguments['employee_id']
+    return employee.display_name, employee.employee_id or arguments['employee_id']
+
+
+@_employee_tool
+def _get_employee_salary(arguments: dict, context: HRContext, employee: Employee) -> str:
+    return employee.salary_json
+
+
+@_employee_tool
+def _get_pto_balance(arguments: dict, context: HRContext, employee: Employee) -> str:
+    return employee.pto_json
+
+
+def _get_health_insurance_plans(arguments: dict, context: HRContext, session_employee: Optional[Employee]) -> str:
+    return context.health_plans_json
+
+
+@_employee_tool
+def _request_w2_form(arguments: dict, context: HRContext, employee: Employee) -> str:
+    employee_name = employee.display_name
+    year = arguments.get('year', 2025)
+
+    # Backend will detect "W-2" and add download link automatically
+    return json_dumps({
+        'success': True,
+        'action': 'request_w2',
+        'employee_name': employee_name,
+        'year': year,
+        'message': f"W-2 tax document for {year} is ready"
+    })
+
+
+def _escalate_to_hr(arguments: dict, context: HRContext, session_employee: Optional[Employee]) -> str:
+    name, emp_id_display = _resolve_identity(arguments, context, session_employee)
+
+    email_body = _HR_ESCALATION_TPL.format(
+        name=name, eid=emp_id_display, subject=arguments['subject'], reason=arguments['reason'])
+
+    return json_dumps({
+        'success': True,
+        'action': 'escalate_to_hr',
+        'employee_id': arguments['employee_id'],
+        'name': name,
+        'subject': arguments['subject'],
+        'reason': arguments['reason'],
+        'email_draft': email_body,
+        'recipient': 'hr@company.com'
+    })
+
+
+@_employee_tool
+def _email_manager(arguments: dict, context: HRContext, employee: Employee) -> str:
+    employee_name = employee.display_name
+    manager_name = employee.manager
+
+    email_body = _MANAGER_EMAIL_TPL.format(
+        manager=manager_name, name=employee_name, subject=arguments['subject'], message=arguments['message'])
+
+    return json_dumps({
+        'success': True,
+        'action': 'email_manager',
+        'employee_name': employee_name,
+        'manager_name': manager_name,
+        'subject': arguments['subject'],
+        'email_draft': email_body
+    })
+
+
+def _schedule_hr_meeting(arguments: dict, context: HRContext, session_employee: Optional[Employee]) -> str:
+    name, emp_id_display = _resolve_identity(arguments, context, session_employee)
+
+    email_body = _HR_MEETING_TPL.format(name=name, eid=emp_id_display, reason=arguments['reason'])
+
+    return json_dumps({
+        'success': True,
+        'action': 'schedule_hr_meeting',
+        'employee_id': arguments['employee_id'],
+        'name': name,
+        'reason': arguments['reason'],
+        'email_draft': email_body
+    })
+
+
+def _unknown(arguments: dict, context: HRContext, session_employee: Optional[Employee]) -> str:
+    return _ERR_UNKNOWN_FUNCTION
+
+
+# ================================================================
+# TOOL EXECUTION
+# ================================================================
+
+# Tool name -> implementation; adding a tool is one entry here
+_DISPATCH = {
+    'get_employee_salary': _get_employee_salary,
+    'get_pto_balance': _get_pto_balance,
+    'get_health_insurance_plans': _get_health_insurance_plans,
+    'request_w2_form': _request_w2_form,
+    'escalate_to_hr': _escalate_to_hr,
+    'email_manager': _email_manager,
+    'schedule_hr_meeting': _schedule_hr_meeting,
+}
+
+
+def execute_function(function_name: str, arguments: dict, context: HRContext,
+                     session_employee: Optional[Employee] = None) -> str:
+    """Execute a function call and return the result - ALWAYS returns valid JSON
+
+    session_employee is the already-resolved employee of the chat session;
+    tool calls about that employee reuse it instead of looking them up again.
+    """
+
+    logger.debug("TOOL CALLED: %s(%s)", function_name, arguments)
+
+    try:
+        return _DISPATCH.get(function_name, _unknown)(arguments, context, session_employee)
+
+    except Exception as e:
+        logger.exception("ERROR in execute_function: %s", function_name)
+        return json_dumps({'success': False, 'error': f'System error: {str(e)}'})
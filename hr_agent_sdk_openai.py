@@ -3,39 +3,35 @@ HR Agent - STANDARD OPENAI FUNCTION CALLING
 ==========================================================
 """
 
-from openai import OpenAI
-import pandas as pd
-import json
-from typing import Optional
+from __future__ import annotations
 
-client = OpenAI()
+from openai import AsyncOpenAI
+import asyncio
+import logging
+from collections import OrderedDict, deque
+from contextlib import aclosing
+from itertools import dropwhile
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterator, Iterator, Optional
 
-# ================================================================
-# HELPER FUNCTIONS
-# ================================================================
+if TYPE_CHECKING:  # only annotations use pandas; callers pass the DataFrames in
+    import pandas as pd
 
-def find_employee(employees_df: pd.DataFrame, employee_id: str) -> Optional[dict]:
-    """Find employee by ID or first name"""
-    
-    # Try by Employee ID
-    if employee_id.upper().startswith('EID'):
-        match = employees_df[employees_df['Employee ID'].astype(str).str.strip().str.upper() == employee_id.upper()]
-        if not match.empty:
-            return match.iloc[0].to_dict()
-    
-    # Try by first name
-    match = employees_df[employees_df['First Name'].astype(str).str.strip().str.lower() == employee_id.lower()]
-    if not match.empty:
-        return match.iloc[0].to_dict()
-    
-    return None
+from hr_agent_core import Employee, HRContext, execute_function, find_employee, json_dumps, json_loads
 
+logger = logging.getLogger(__name__)
+
+# The SDK retries rate limits, timeouts and 5xx with exponential backoff
+client = AsyncOpenAI(max_retries=3)
+
+_INVALID_ARGUMENTS = json_dumps({'success': False, 'error': 'invalid_arguments'})
 
 # ================================================================
 # FUNCTION DEFINITIONS FOR OPENAI
 # ================================================================
 
-TOOLS = [
+# A tuple: the schemas are fixed and sent unchanged on every request
+TOOLS = (
     {
         "type": "function",
         "function": {
@@ -138,411 +134,431 @@ TOOLS = [
             }
         }
     }
-]
-
-SYSTEM_PROMPT = """You are a helpful HR assistant. Answer questions directly and use tools when needed.
-
-CRITICAL FORMATTING RULE:
-NEVER create markdown links like [here](#) or [download](#) or [click here](#) in your responses.
-The system will automatically add download buttons and links when needed - you should NEVER create them yourself.
-
-MANAGER NAME RULE:
-The employee's manager is ALWAYS "John Smith". When drafting emails to the manager:
-- Use "To: John Smith"
-- Greet with "Hi John," (not "Hi [Manager's Name]" or any placeholder)
-
-CRITICAL RULE - REMEMBER YOUR OFFERS:
-If you JUST said "Would you like me to X?" and user says "yes/sure/okay"
-→ DO X IMMEDIATELY. Don't ask what they want.
-
-EXAMPLES:
-
-EXAMPLE 1 - PTO REQUEST (EXACT SCENARIO):
-User: "Can I take a day off on Monday?"
-You: [Call get_pto_balance]
-You: "You have 13 PTO days remaining. To request time off, I can help you email your manager for approval. Would you like me to do that?"
-User: "Yes"
-You: [IMMEDIATELY call email_manager with subject="PTO Request for Monday" and message about Monday]
-You: "Here's the email draft I prepared for your manager:
-
-To: John Smith
-Subject: PTO Request for Monday
-
-Hi John,
-
-I would like to request a day off on Monday. Please let me know if that works.
-
-Best regards,
-Thomas
-
-Review it and click 'Send Email' when ready."
-
-CRITICAL EMAIL FORMATTING:
-- ALWAYS use "John Smith" as the manager name (To: John Smith)
-- ALWAYS greet with "Hi John," (not "Hi [Manager's Name]")
-- Format emails exactly like this:
-
-To: John Smith
-Subject: [subject line]
-
-Hi John,
-
-[message body]
-
-Best regards,
-[sender name]
-
-This allows the system to properly display Send/Cancel buttons.
-
-WRONG BEHAVIOR (NEVER DO THIS):
-User: "Yes"
-You: "What can I assist you with today?" ← FORBIDDEN! You JUST offered to email manager!
-
-EXAMPLE 2 - 401K (BRIEF THEN DETAILED):
-User: "What are my 401k options?"
-You: "We offer a 401(k) plan with a 6% company match. Would you like to know more about the matching details, vesting schedule, contribution limits, or investment options? Or I can help you get started with enrollment."
-
-User: "Tell me about the match"
-You: "The company matches 100% on the first 6% you contribute. So if you contribute 6% of your salary, the company adds another 6% - that's free money! For example, on your salary that would be about $3,716/year from the company."
-
-User: "What about vesting?"
-You: "Your contributions are 100% vested immediately (they're always yours). The company match vests at 20% per year over 5 years, so you'll be fully vested after 5 years of employment."
-
-User: "I'd like to enroll"
-You: [IMMEDIATELY call escalate_to_hr with subject="401(k) Enrollment Request"]
-You: "Here's the email to HR: [show email_draft]"
-
-WRONG BEHAVIOR (NEVER DO THIS):
-User: "Yes I'd like to enroll"
-You: "What would you like to enroll in?" ← FORBIDDEN! You were JUST talking about 401k!
-
-EXAMPLE 3 - HEALTH INSURANCE (SHOW ALL DETAILS):
-User: "What are my health insurance options?"
-You: [Call get_health_insurance_plans]
-You: "Here are your health insurance options:
-
-**Blue Shield PPO Gold**
-- Employee Cost: $250/month
-- Family Cost: $650/month
-- Deductible: $500 (individual), $1000 (family)
-- Out-of-Pocket Max: $3000 (individual), $6000 (family)
-- Coverage: Nationwide network, no referrals needed, covers 80% after deductible
-
-[Continue with other plans...]"
+)
+
+# Argument checks derived from the schemas above, checked before dispatch.
+# Only string fields are type-checked: the tools call string methods on
+# them, while "year" just feeds an f-string and tolerates "2025".
+_JSON_TYPES = {'string': str}
+
+_ARG_CHECKS = {
+    tool['function']['name']: (
+        tuple(tool['function']['parameters'].get('required', ())),
+        tuple(
+            (name, _JSON_TYPES[spec['type']])
+            for name, spec in tool['function']['parameters'].get('properties', {}).items()
+            if spec['type'] in _JSON_TYPES
+        ),
+    )
+    for tool in TOOLS
+}
+
+
+def _check_arguments(function_name: str, arguments: dict) -> Optional[str]:
+    """Error reply when arguments don't match the tool's schema, else None"""
+    checks = _ARG_CHECKS.get(function_name)
+    if checks is None:
+        return None  # unknown tool: execute_function reports it
+    required, typed = checks
+    missing = [name for name in required if name not in arguments]
+    wrong_type = [name for name, expected in typed
+                  if name in arguments and not isinstance(arguments[name], expected)]
+    if not missing and not wrong_type:
+        return None
+    return json_dumps({'success': False, 'error': 'invalid_arguments',
+                       'missing': missing, 'wrong_type': wrong_type})
+
+
+# Kept in a text file so it can be edited without touching code
+SYSTEM_PROMPT = Path(__file__).with_name('hr_instructions.txt').read_text(encoding='utf-8').rstrip('\n')
+
+# Sent first and byte-identical on every request so OpenAI's automatic prompt
+# caching can reuse the tools + system prefix. Per-employee details go in a
+# separate message after it.
+_SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+_EMPLOYEE_CONTEXT = """IMPORTANT CONTEXT:
+You are currently helping employee: {employee_id}
+When calling tools like get_pto_balance, get_employee_salary, request_w2_form, etc., ALWAYS use "{employee_id}" as the employee_id parameter.
+The user doesn't need to tell you their ID - you already know it's {employee_id}."""
 
-WRONG BEHAVIOR (NEVER DO THIS):
-User: "What are my health insurance options?"
-You: "Here are the plans: Blue Shield PPO, Kaiser HMO... but I don't have cost details" ← FORBIDDEN! The costs ARE in the tool response!
+# Older turns are folded into a short rolling summary rather than resent
+_SUMMARY_PROMPT = """Summarize this HR assistant conversation in at most 500 characters.
+Keep facts the assistant may need later: figures already looked up, requests made, drafts sent or pending."""
+_SUMMARY_CONTEXT = "Summary of the earlier conversation:\n{summary}"
+
+# Replies that confirm a draft the agent just prepared. These are answered
+# directly instead of paying for another model round-trip. Nothing is sent
+# from the chat: the user sends a draft with its Send Email button, so the
+# reply points them there rather than claiming delivery.
+_CONFIRMATIONS = frozenset({'yes', 'sure', 'ok', 'okay', 'yep', 'send it'})
+_DRAFT_READY_RESPONSES = {
+    'email_manager': "Your email to your manager is drafted but not sent yet. Review the draft above and click Send Email to send it.",
+    'escalate_to_hr': "Your request to HR is drafted but not sent yet. Review the draft above and click Send Email to send it.",
+    'schedule_hr_meeting': "Your meeting request to HR is drafted but not sent yet. Review the draft above and click Send Email to send it.",
+}
+
+# Replies grounded only in these tools depend on nothing but static data,
+# so a repeat of the same question, asked after the same assistant reply,
+# can reuse the earlier answer. The reply is part of the key because a
+# follow-up ("what about family coverage?") means something different after
+# each answer. Confirmations and messages that hint at an action are never
+# answered from the cache.
+_READ_ONLY_TOOLS = frozenset({'get_employee_salary', 'get_pto_balance', 'get_health_insurance_plans'})
+_ACTION_WORDS = ('escalate', 'email', 'schedule', 'meeting', 'enroll', 'raise', 'send', 'w-2', 'w2')
+
+PLANNING_MODEL = "gpt-4o"        # reads intent and picks tools
+SYNTHESIS_MODEL = "gpt-4o-mini"  # phrases the reply from tool results
+
+MAX_HISTORY = 20          # messages kept per employee
+MAX_CONVERSATIONS = 1000  # employees kept in memory (least recently active evicted)
+MAX_CONTENT_CHARS = 4096  # per user/assistant message kept in history
+MAX_CONCURRENT_REQUESTS = 10  # OpenAI calls in flight across all employees
+SUMMARIZE_AT = 16         # history length that triggers folding older turns into the summary
+KEEP_RECENT = 4           # messages always kept verbatim
+MAX_CACHED_REPLIES = 512  # cached replies, least recently used evicted
 
-EXAMPLE 4 - W-2 REQUEST (SAY NOTHING ABOUT LINKS):
-User: "Can I get my W-2?"
-You: [IMMEDIATELY call request_w2_form with year=2025]
-You: "Your W-2 tax document for 2025 is ready."
 
-CORRECT - Just say it's ready. The download button appears automatically below your message.
+# ================================================================
+# AGENT SYSTEM
+# ================================================================
 
-WRONG BEHAVIOR (NEVER DO THIS):
-User: "Can I get my W-2?"
-You: "Your W-2 for 2025 is ready! You can download it [here](#)" ← FORBIDDEN! Don't add links!
-OR
-You: "Your W-2 for 2025 is ready! Download it here" ← FORBIDDEN! Don't say "download"!
-OR
-You: "For which tax year?" ← FORBIDDEN! Assume 2025!
+def _bound_content(text: Optional[str], cap: int = MAX_CONTENT_CHARS) -> Optional[str]:
+    """Clamp text kept in history; what the user is sent is not affected"""
+    if text is None or len(text) <= cap:
+        return text
+    return text[:cap]
 
-SIMPLE RULES:
-1. Answer questions directly
-2. Use tools to get data (salary, PTO, health plans, W-2)
-3. When user wants to DO something (enroll, take PTO, etc.), use email_manager or escalate_to_hr
-4. Always show the email_draft from tool responses
-5. When user says "yes" to your offer, DO IT - don't ask again
-6. **HEALTH INSURANCE:** When showing health insurance plans, ALWAYS include ALL details: name, type, employee cost, family cost, deductible, out-of-pocket max, and coverage details. NEVER say you don't have the information - it's in the tool response!
-7. **401(k) RETIREMENT PLAN - CONVERSATIONAL APPROACH:**
-   
-   **Initial Response (BRIEF):**
-   "We offer a 401(k) plan with a 6% company match. Would you like to know more about the matching details, vesting schedule, contribution limits, or investment options? Or I can help you get started with enrollment."
-   
-   **Follow-Up Details (if asked):**
-   - **Match/Matching:** Company matches 100% on first 6% you contribute (free money!)
-   - **Vesting:** Your contributions are 100% vested immediately. Company match vests 20% per year over 5 years (100% after 5 years)
-   - **Contribution limits:** $23,500/year if under 50, $31,000/year if 50+ (includes catch-up)
-   - **Investment options:** Target-date funds, S&P 500 index funds, international funds, bond funds (managed by Fidelity)
-   - **How to enroll/change:** Can enroll or change contribution anytime through payroll
-   
-   Answer ONLY what they ask about. Don't dump all info at once.
 
-8. **W-2 TAX FORMS - INSTANT ACCESS:**
-   When user asks for W-2 (without specifying year), automatically assume they want 2025 (the most recent tax year).
-   DO NOT ask "which year?" - just use 2025.
-   Call request_w2_form with year=2025.
-   After calling the tool, respond with EXACTLY: "Your W-2 tax document for 2025 is ready."
-   
-   CRITICAL - DO NOT:
-   - Add the word "download" to your response
-   - Add any links like [here](#) or [download](#) 
-   - Say "click here" or "available here"
-   - Add ANY brackets [ ] to your response
-   - The system will automatically add a download button - you don't need to mention it!
+def _is_tool_reply(message: dict) -> bool:
+    return message['role'] == 'tool'
 
-BE DIRECT. CALL TOOLS. REMEMBER CONTEXT."""
 
+class _Conversation:
+    """One employee's chat state"""
+    
+    __slots__ = ('lock', 'messages', 'pending_action', 'summary', 'compaction')
+    
+    def __init__(self):
+        self.lock = asyncio.Lock()  # one turn at a time per employee
+        self.messages = deque(maxlen=MAX_HISTORY)
+        self.pending_action = None  # draft tool awaiting confirmation
+        self.summary = None         # rolling summary of turns no longer in messages
+        self.compaction = None      # background summarizing task, if any
+    
+    def history(self) -> Iterator[dict]:
+        """Messages to send, minus tool replies whose call was trimmed off"""
+        return dropwhile(_is_tool_reply, self.messages)
 
-# ================================================================
-# TOOL EXECUTION
-# ================================================================
 
-def execute_function(function_name: str, arguments: dict, employees_df: pd.DataFrame, health_plans_df: pd.DataFrame) -> str:
-    """Execute a function call and return the result - ALWAYS returns valid JSON"""
+class HRAgentSystem:
+    __slots__ = ('context', 'employee_conversations', '_api_slots', '_reply_cache')
+    
+    def __init__(self, employees_df: pd.DataFrame, health_plans_df: Optional[pd.DataFrame]):
+        self.context = HRContext(employees_df, health_plans_df)
+        self.employee_conversations = OrderedDict()  # LRU: employee_id -> _Conversation
+        self._api_slots = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        self._reply_cache = OrderedDict()  # LRU: (employee_id, previous reply, question) -> reply
     
-    print(f"\n🔧 EXECUTING: {function_name}({arguments})")
+    def _conversation(self, employee_id: str) -> _Conversation:
+        """Fetch or start an employee's conversation, marking it most recent"""
+        conversations = self.employee_conversations
+        state = conversations.get(employee_id)
+        if state is None:
+            state = conversations[employee_id] = _Conversation()
+            if len(conversations) > MAX_CONVERSATIONS:
+                conversations.popitem(last=False)
+        else:
+            conversations.move_to_end(employee_id)
+        return state
     
-    try:
-        if function_name == "get_employee_salary":
-            employee = find_employee(employees_df, arguments['employee_id'])
-            if employee is None:
-                return json.dumps({'success': False, 'error': 'Employee not found'})
-            return json.dumps({'success': True, 'salary': employee.get('Salary', 'Unknown')})
+    async def _compact(self, employee_id: str, state: _Conversation):
+        """Fold older messages into the rolling summary, keeping the recent tail verbatim
         
-        elif function_name == "get_pto_balance":
-            employee = find_employee(employees_df, arguments['employee_id'])
-            if employee is None:
-                return json.dumps({'success': False, 'error': 'Employee not found'})
-            pto_column = 'Days Off Remaining' if 'Days Off Remaining' in employees_df.columns else 'Days Off'
-            return json.dumps({'success': True, 'pto_remaining': employee.get(pto_column, 'Unknown')})
+        Runs as a background task once a reply is done; the employee's next
+        turn waits for it before touching the history.
+        """
+        messages = state.messages
+        # Cut at a user message so no tool call is split from its replies
+        cut = len(messages) - KEEP_RECENT
+        while cut > 0 and messages[cut]['role'] != 'user':
+            cut -= 1
+        if cut <= 0:
+            return
         
-        elif function_name == "get_health_insurance_plans":
-            plans = []
-            for _, plan in health_plans_df.iterrows():
-                plans.append({
-                    'name': plan.get('Plan Name', 'Unknown'),
-                    'type': plan.get('Plan Type', 'Unknown'),
-                    'employee_cost': plan.get('Monthly Cost Employee', plan.get('Employee Monthly Cost', 'Unknown')),
-                    'family_cost': plan.get('Monthly Cost Family', plan.get('Family Monthly Cost', 'Unknown')),
-                    'deductible_individual': plan.get('Deductible Individual', plan.get('Deductible', 'Unknown')),
-                    'deductible_family': plan.get('Deductible Family', 'Unknown'),
-                    'oop_max_individual': plan.get('Out of Pocket Max Individual', 'Unknown'),
-                    'oop_max_family': plan.get('Out of Pocket Max Family', 'Unknown'),
-                    'coverage_details': plan.get('Coverage Details', 'Unknown')
-                })
-            return json.dumps({'success': True, 'plans': plans})
+        transcript = '\n'.join(
+            f"{messages[i]['role']}: {messages[i]['content']}"
+            for i in range(cut)
+            if messages[i]['content']
+        )
+        if state.summary:
+            transcript = f"Earlier summary: {state.summary}\n{transcript}"
         
-        elif function_name == "request_w2_form":
-            employee = find_employee(employees_df, arguments['employee_id'])
-            if employee is None:
-                return json.dumps({'success': False, 'error': 'Employee not found'})
-            
-            employee_name = employee.get('First Name', 'Unknown')
-            year = arguments.get('year', 2025)
-            
-            # Backend will detect "W-2" and add download link automatically
-            return json.dumps({
-                'success': True,
-                'action': 'request_w2',
-                'employee_name': employee_name,
-                'year': year,
-                'message': f"W-2 tax document for {year} is ready"
-            })
+        try:
+            async with self._api_slots:
+                response = await client.chat.completions.create(
+                    model=SYNTHESIS_MODEL,
+                    messages=[
+                        {"role": "system", "content": _SUMMARY_PROMPT},
+                        {"role": "user", "content": transcript}
+                    ]
+                )
+        except Exception:
+            # The deque still bounds history; try again on a later turn
+            logger.exception("summarizing history failed for %s", employee_id)
+            return
         
-        elif function_name == "escalate_to_hr":
-            employee = find_employee(employees_df, arguments['employee_id'])
-            name = 'Unknown Employee'
-            emp_id_display = arguments['employee_id']
-            if employee is not None:
-                name = employee.get('First Name', employee.get('Employee Name', 'Unknown'))
-                emp_id_display = employee.get('Employee ID', arguments['employee_id'])
-            
-            email_body = f"""Dear HR Team,
-
-Employee: {name} (ID: {emp_id_display})
-Subject: {arguments['subject']}
-
-REQUEST DETAILS:
-{arguments['reason']}
-
-This request has been escalated for your review and assistance.
-
-Best regards,
-HR Assistant Bot"""
-            
-            return json.dumps({
-                'success': True,
-                'action': 'escalate_to_hr',
-                'employee_id': arguments['employee_id'],
-                'name': name,
-                'subject': arguments['subject'],
-                'reason': arguments['reason'],
-                'email_draft': email_body,
-                'recipient': 'hr@company.com'
-            })
+        state.summary = _bound_content(response.choices[0].message.content)
+        for _ in range(cut):
+            messages.popleft()
+    
+    async def _finish_compaction(self, employee_id: str, state: _Conversation):
+        """Wait for the previous turn's summarizing task
         
-        elif function_name == "email_manager":
-            employee = find_employee(employees_df, arguments['employee_id'])
-            if employee is None:
-                return json.dumps({'success': False, 'error': 'Employee not found'})
+        A task that was cancelled (its event loop ended, as with one
+        asyncio.run per message) or that failed just means no summary this
+        time; it must not decide whether this turn succeeds.
+        """
+        task = state.compaction
+        loop = asyncio.get_running_loop()
+        try:
+            if not task.done() and task.get_loop() is not loop:
+                task.cancel()  # left on a loop that has stopped; it can never finish
+            else:
+                # Shielded so cancelling this turn doesn't cancel the summary
+                await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.cancelled():
+                raise  # this turn was cancelled, not the summary
+        except Exception:
+            logger.exception("summarizing history failed for %s", employee_id)
+        finally:
+            # Still running only if this turn was cancelled; the next turn waits for it
+            if task.done() or task.get_loop() is not loop:
+                state.compaction = None
+    
+    def _run_tool_call(self, tool_call, session_employee: Optional[Employee]) -> str:
+        """Parse and execute one tool call, returning the JSON tool reply"""
+        try:
+            try:
+                function_args = json_loads(tool_call.function.arguments)
+            except ValueError:
+                function_args = None
             
-            employee_name = employee.get('First Name', 'Unknown')
-            manager_name = employee.get('Manager', 'John Smith')  # Default to John Smith for demo
+            if not isinstance(function_args, dict):
+                # Hallucinated/garbled arguments: report it so the model can retry
+                return _INVALID_ARGUMENTS
             
-            email_body = f"""To: {manager_name}
-From: {employee_name}
-Subject: {arguments['subject']}
-
-{arguments['message']}
-
-Best regards,
-{employee_name}"""
+            invalid = _check_arguments(tool_call.function.name, function_args)
+            if invalid is not None:
+                return invalid
             
-            return json.dumps({
-                'success': True,
-                'action': 'email_manager',
-                'employee_name': employee_name,
-                'manager_name': manager_name,
-                'subject': arguments['subject'],
-                'email_draft': email_body
-            })
+            return execute_function(tool_call.function.name, function_args, self.context, session_employee)
         
-        elif function_name == "schedule_hr_meeting":
-            employee = find_employee(employees_df, arguments['employee_id'])
-            name = 'Unknown Employee'
-            emp_id_display = arguments['employee_id']
-            if employee is not None:
-                name = employee.get('First Name', employee.get('Employee Name', 'Unknown'))
-                emp_id_display = employee.get('Employee ID', arguments['employee_id'])
-            
-            email_body = f"""Dear HR Team,
-
-MEETING REQUEST
-Employee: {name} (ID: {emp_id_display})
-
-REASON FOR MEETING:
-{arguments['reason']}
-
-Please send a calendar invitation to schedule a meeting time with this employee.
-
-Best regards,
-HR Assistant Bot"""
-            
-            return json.dumps({
-                'success': True,
-                'action': 'schedule_hr_meeting',
-                'employee_id': arguments['employee_id'],
-                'name': name,
-                'reason': arguments['reason'],
-                'email_draft': email_body
-            })
-        
-        else:
-            return json.dumps({'success': False, 'error': 'Unknown function'})
+        except Exception as e:
+            logger.exception("ERROR processing tool call")
+            return json_dumps({'success': False, 'error': f'Tool execution failed: {str(e)}'})
     
-    except Exception as e:
-        print(f"❌ ERROR in execute_function: {function_name}, {e}")
-        import traceback
-        traceback.print_exc()
-        return json.dumps({'success': False, 'error': f'System error: {str(e)}'})
-
-
-# ================================================================
-# AGENT SYSTEM
-# ================================================================
-
-class HRAgentSystem:
-    def __init__(self, employees_df: pd.DataFrame, health_plans_df: pd.DataFrame):
-        self.employees_df = employees_df
-        self.health_plans_df = health_plans_df
-        self.employee_conversations = {}
+    async def _read_synthesis(self, messages: list, queue: asyncio.Queue):
+        """Stream the synthesis reply into queue, then None, holding an API slot only while reading"""
+        try:
+            async with self._api_slots:
+                stream = await client.chat.completions.create(
+                    model=SYNTHESIS_MODEL,
+                    messages=messages,
+                    tools=TOOLS,
+                    tool_choice="none",
+                    stream=True
+                )
+                async for chunk in stream:
+                    if not chunk.choices:
+                        continue
+                    content = chunk.choices[0].delta.content
+                    if content:
+                        queue.put_nowait(content)
+        finally:
+            queue.put_nowait(None)
     
     async def chat(self, employee_id: str, message: str) -> dict:
         """Chat with the HR agent"""
-        
-        if employee_id not in self.employee_conversations:
-            self.employee_conversations[employee_id] = []
-        
-        conversation = self.employee_conversations[employee_id]
-        conversation.append({'role': 'user', 'content': message})
-        
-        if len(conversation) > 20:
-            conversation = conversation[-20:]
-            self.employee_conversations[employee_id] = conversation
-        
         try:
-            print(f"\n{'='*60}")
-            print(f"EMPLOYEE: {employee_id}, MESSAGE: {message}")
-            print(f"{'='*60}\n")
-            
-            # Tell AI who the employee is
-            system_prompt_with_context = f"""{SYSTEM_PROMPT}
-
-IMPORTANT CONTEXT:
-You are currently helping employee: {employee_id}
-When calling tools like get_pto_balance, get_employee_salary, request_w2_form, etc., ALWAYS use "{employee_id}" as the employee_id parameter.
-The user doesn't need to tell you their ID - you already know it's {employee_id}."""
-            
-            response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "system", "content": system_prompt_with_context}] + conversation,
-                tools=TOOLS,
-                tool_choice="auto"
-            )
-            
-            response_message = response.choices[0].message
-            tool_calls = response_message.tool_calls
-            
-            if not tool_calls:
-                assistant_message = response_message.content
-                conversation.append({'role': 'assistant', 'content': assistant_message})
-                print(f"\n📤 RESPONSE: {assistant_message}\n")
-                return {'success': True, 'response': assistant_message}
-            
-            conversation.append(response_message.model_dump())
-            
-            for tool_call in tool_calls:
-                try:
-                    function_name = tool_call.function.name
-                    function_args = json.loads(tool_call.function.arguments)
-                    
-                    function_response = execute_function(
-                        function_name,
-                        function_args,
-                        self.employees_df,
-                        self.health_plans_df
-                    )
-                    
-                    conversation.append({
-                        'role': 'tool',
-                        'tool_call_id': tool_call.id,
-                        'name': function_name,
-                        'content': function_response
-                    })
-                    
-                except Exception as e:
-                    print(f"❌ ERROR processing tool call: {e}")
-                    conversation.append({
-                        'role': 'tool',
-                        'tool_call_id': tool_call.id,
-                        'name': tool_call.function.name,
-                        'content': json.dumps({'success': False, 'error': f'Tool execution failed: {str(e)}'})
-                    })
-            
-            final_response = client.chat.completions.create(
-                model="gpt-4o",
-                messages=[{"role": "system", "content": system_prompt_with_context}] + conversation,
-                tools=TOOLS,
-                tool_choice="auto"
-            )
-            
-            assistant_message = final_response.choices[0].message.content
-            conversation.append({'role': 'assistant', 'content': assistant_message})
-            
-            print(f"\n📤 FINAL RESPONSE: {assistant_message}\n")
-            
-            return {'success': True, 'response': assistant_message}
+            parts = [chunk async for chunk in self.chat_stream(employee_id, message)]
+            return {'success': True, 'response': ''.join(parts)}
             
         except Exception as e:
-            import traceback
-            print(f"\n❌ ERROR:")
-            print(traceback.format_exc())
+            logger.exception("chat failed for %s", employee_id)
             
             return {
                 'success': False,
                 'response': f"I apologize, but I encountered an issue: {str(e)}",
                 'error': str(e)
             }
+    
+    async def chat_batch(self, pairs: list) -> list:
+        """Answer several (employee_id, message) pairs concurrently, results in input order
+        
+        Different employees proceed in parallel; messages from the same
+        employee still queue on that conversation's lock in the order given.
+        """
+        return await asyncio.gather(*(self.chat(employee_id, message) for employee_id, message in pairs))
+    
+    async def chat_stream(self, employee_id: str, message: str, draft_buttons: bool = True) -> AsyncIterator[str]:
+        """Chat with the HR agent, yielding the reply text as it is generated
+        
+        Pass draft_buttons=False when the caller does not show a Send Email
+        button for drafts; a later "yes" then goes to the model instead of
+        the canned reply pointing to that button.
+        """
+        # "Thomas", "thomas" and "EID2480002" share one history
+        employee_id = self.context.canonical_id(employee_id) or employee_id
+        state = self._conversation(employee_id)
+        
+        # Concurrent requests for the same employee would otherwise
+        # interleave their messages in the shared history
+        async with state.lock:
+            if state.compaction is not None:
+                await self._finish_compaction(employee_id, state)
+            
+            # Closed with this generator, so a client disconnect releases
+            # the API slot and the OpenAI stream right away
+            async with aclosing(self._chat_turn(employee_id, message, state, draft_buttons)) as chunks:
+                async for chunk in chunks:
+                    yield chunk
+            
+            # Summarize after the reply, off the user's critical path
+            if len(state.messages) >= SUMMARIZE_AT:
+                state.compaction = asyncio.create_task(self._compact(employee_id, state))
+    
+    async def _chat_turn(self, employee_id: str, message: str, state: _Conversation,
+                         draft_buttons: bool) -> AsyncIterator[str]:
+        conversation = state.messages
+        # What the message may be answering ("yes" to which offer?)
+        previous_reply = next(
+            (m['content'] for m in reversed(conversation) if m['role'] == 'assistant' and m['content']),
+            state.summary)
+        conversation.append({'role': 'user', 'content': _bound_content(message)})
+        
+        question = message.strip().casefold()
+        
+        # "yes"/"send it" right after a draft: point to the Send Email button without calling the model
+        pending_action, state.pending_action = state.pending_action, None
+        if pending_action is not None and question.rstrip('.!') in _CONFIRMATIONS:
+            assistant_message = _DRAFT_READY_RESPONSES[pending_action]
+            conversation.append({'role': 'assistant', 'content': assistant_message})
+            yield assistant_message
+            return
+        
+        # A repeated read-only question in the same context: reuse the earlier answer
+        cache_key = None
+        if question.rstrip('.!') not in _CONFIRMATIONS and not any(word in question for word in _ACTION_WORDS):
+            cache_key = (employee_id, previous_reply, question)
+            assistant_message = self._reply_cache.get(cache_key)
+            if assistant_message is not None:
+                self._reply_cache.move_to_end(cache_key)
+                conversation.append({'role': 'assistant', 'content': _bound_content(assistant_message)})
+                yield assistant_message
+                return
+        
+        logger.debug("EMPLOYEE: %s, MESSAGE: %s", employee_id, message)
+        
+        # Tell AI who the employee is
+        system_messages = [
+            _SYSTEM_MESSAGE,
+            {"role": "system", "content": _EMPLOYEE_CONTEXT.format(employee_id=employee_id)}
+        ]
+        if state.summary:
+            system_messages.append({"role": "system", "content": _SUMMARY_CONTEXT.format(summary=state.summary)})
+        
+        # Planning call: usually returns tool calls rather than prose, so it
+        # is not streamed
+        async with self._api_slots:
+            response = await client.chat.completions.create(
+                model=PLANNING_MODEL,
+                messages=[*system_messages, *state.history()],
+                tools=TOOLS,
+                tool_choice="auto"
+            )
+        
+        response_message = response.choices[0].message
+        tool_calls = response_message.tool_calls
+        
+        if not tool_calls:
+            assistant_message = response_message.content
+            conversation.append({'role': 'assistant', 'content': _bound_content(assistant_message)})
+            logger.debug("RESPONSE: %s", assistant_message)
+            if assistant_message:
+                yield assistant_message
+            return
+        
+        # Only the fields the API needs to pair tool results with calls
+        conversation.append({
+            'role': 'assistant',
+            'content': response_message.content,
+            'tool_calls': [
+                {
+                    'id': tool_call.id,
+                    'type': 'function',
+                    'function': {
+                        'name': tool_call.function.name,
+                        'arguments': tool_call.function.arguments
+                    }
+                }
+                for tool_call in tool_calls
+            ]
+        })
+        
+        # Resolved once for all of this turn's tool calls
+        session_employee = find_employee(self.context, employee_id)
+        
+        # All of this turn's tool calls come back in one response. The tools
+        # are in-memory lookups taking microseconds, so they run inline on
+        # the event loop rather than paying a thread hop each.
+        function_responses = [
+            self._run_tool_call(tool_call, session_employee)
+            for tool_call in tool_calls
+        ]
+        
+        drafted = None
+        for tool_call, function_response in zip(tool_calls, function_responses):
+            function_name = tool_call.function.name
+            conversation.append({
+                'role': 'tool',
+                'tool_call_id': tool_call.id,
+                'name': function_name,
+                'content': function_response
+            })
+            if function_name in _DRAFT_READY_RESPONSES and json_loads(function_response).get('success'):
+                drafted = function_name
+        
+        # Synthesis only: the tool results are in hand, so a smaller model
+        # writes the reply. Tools stay listed to keep the prompt prefix
+        # stable across turns, but no further calls may be planned.
+        # Streamed so the first words reach the user without waiting for
+        # the whole reply. A separate task reads OpenAI into a queue, so the
+        # API slot is freed as soon as OpenAI is done, however slowly the
+        # caller consumes the chunks.
+        queue = asyncio.Queue()
+        reader = asyncio.create_task(self._read_synthesis([*system_messages, *state.history()], queue))
+        parts = []
+        try:
+            while (content := await queue.get()) is not None:
+                parts.append(content)
+                yield content
+            await reader  # re-raises a failed read
+        finally:
+            reader.cancel()  # the caller stopped early
+        
+        # Recorded only once the stream completes
+        assistant_message = ''.join(parts)
+        conversation.append({'role': 'assistant', 'content': _bound_content(assistant_message)})
+        if drafted is not None:
+            # A reply ending in a question ("...change the date?") leaves
+            # "yes" for the model to interpret
+            if draft_buttons and not assistant_message.rstrip().endswith('?'):
+                state.pending_action = drafted
+        elif cache_key is not None and all(tool_call.function.name in _READ_ONLY_TOOLS for tool_call in tool_calls):
+            self._reply_cache[cache_key] = assistant_message
+            if len(self._reply_cache) > MAX_CACHED_REPLIES:
+                self._reply_cache.popitem(last=False)
+        
+        logger.debug("FINAL RESPONSE: %s", assistant_message)
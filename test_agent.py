@@ -0,0 +1,245 @@
+#!/usr/bin/env python3
+"""
+Agent Tests
+Runs HRAgentSystem against a scripted fake OpenAI client - no server or API key needed
+Run: python3 -m unittest test_agent
+"""
+
+import asyncio
+import json
+import os
+import unittest
+from types import SimpleNamespace
+
+import pandas as pd
+
+os.environ.setdefault('OPENAI_API_KEY', 'test')
+import hr_agent_sdk_openai as agent
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def _message(content=None, tool_calls=None):
+    return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content, tool_calls=tool_calls))])
+
+
+def _tool_call(call_id, name, arguments):
+    return SimpleNamespace(id=call_id, type='function',
+                           function=SimpleNamespace(name=name, arguments=json.dumps(arguments)))
+
+
+async def _stream(text):
+    yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+
+class FakeCompletions:
+    """Answers each chat.completions.create call with the next scripted response"""
+
+    def __init__(self, script):
+        self.script = list(script)
+        self.calls = 0
+
+    async def create(self, **kwargs):
+        if 'tools' not in kwargs:
+            # Summarizing call: slow enough to still be running when asyncio.run ends
+            await asyncio.sleep(0.05)
+            return _message('Earlier turns were small talk.')
+        self.calls += 1
+        response = self.script.pop(0)
+        if kwargs.get('stream'):
+            return _stream(response.choices[0].message.content)
+        return response
+
+
+class AgentTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.system = agent.HRAgentSystem(
+            pd.read_csv(os.path.join(HERE, 'employees.csv')),
+            pd.read_csv(os.path.join(HERE, 'health_plans.csv')),
+        )
+        self.real_client = agent.client
+
+    def tearDown(self):
+        agent.client = self.real_client
+
+    def run_chat(self, script, messages):
+        completions = FakeCompletions(script)
+        agent.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+        replies = [asyncio.run(self.system.chat('Thomas', text))['response'] for text in messages]
+        return replies, completions.calls
+
+
+class BlankCellTest(AgentTestCase):
+
+    def test_blank_first_name_falls_back_to_unknown(self):
+        context = self.system.context
+        employee = agent.find_employee(context, 'EID2480024')  # First Name is blank in the CSV
+        self.assertIsNone(employee.first_name)
+        self.assertEqual(employee.display_name, 'Unknown')
+        self.assertIsNone(agent.find_employee(context, 'nan'))
+
+
+class DraftConfirmationTest(AgentTestCase):
+
+    def test_yes_after_draft_points_to_send_button(self):
+        draft = {'employee_id': 'EID2480002', 'subject': 'PTO', 'message': 'Monday off'}
+        replies, calls = self.run_chat(
+            [
+                _message(tool_calls=[_tool_call('c1', 'email_manager', draft)]),
+                _message("Here's the email draft I prepared for your manager."),
+            ],
+            ['Email my manager about Monday off', 'ok'],
+        )
+        self.assertIn('click Send Email', replies[1])
+        self.assertNotIn('has been sent', replies[1])
+        self.assertEqual(calls, 2)
+
+    def test_yes_after_a_streamed_draft_without_buttons_goes_to_the_model(self):
+        draft = {'employee_id': 'EID2480002', 'subject': 'PTO', 'message': 'Monday off'}
+        completions = FakeCompletions([
+            _message(tool_calls=[_tool_call('c1', 'email_manager', draft)]),
+            _message("Here's the email draft I prepared for your manager."),
+            _message('Copy the draft into your email client to send it.'),
+        ])
+        agent.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        async def stream(text):
+            return ''.join([chunk async for chunk in self.system.chat_stream('Thomas', text, draft_buttons=False)])
+
+        asyncio.run(stream('Email my manager about Monday off'))
+        self.assertEqual(asyncio.run(stream('ok')), 'Copy the draft into your email client to send it.')
+        self.assertEqual(completions.calls, 3)
+
+    def test_yes_to_a_follow_up_question_goes_to_the_model(self):
+        draft = {'employee_id': 'EID2480002', 'subject': 'PTO', 'message': 'Monday off'}
+        replies, calls = self.run_chat(
+            [
+                _message(tool_calls=[_tool_call('c1', 'email_manager', draft)]),
+                _message("Here's the draft. Would you like me to change the date?"),
+                _message('Sure - which date would you like instead?'),
+            ],
+            ['Email my manager about Monday off', 'yes'],
+        )
+        self.assertEqual(replies[1], 'Sure - which date would you like instead?')
+        self.assertEqual(calls, 3)
+
+
+class LongConversationTest(AgentTestCase):
+
+    def test_turns_after_a_cancelled_summary_still_succeed(self):
+        # One asyncio.run per message cancels each background summary
+        # before it finishes; later turns must go on without it
+        texts = [f'Reply {i}' for i in range(16)]
+        replies, calls = self.run_chat([_message(text) for text in texts], [f'Message {i}' for i in range(16)])
+        self.assertEqual(replies, texts)
+        self.assertEqual(calls, 16)
+
+
+class StreamSlotTest(AgentTestCase):
+
+    def test_closing_the_stream_early_releases_the_api_slot(self):
+        pto = {'employee_id': 'EID2480002'}
+        completions = FakeCompletions([
+            _message(tool_calls=[_tool_call('c1', 'get_pto_balance', pto)]),
+            _message('You have 13 PTO days.'),
+        ])
+        agent.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        async def disconnect_after_first_chunk():
+            chunks = self.system.chat_stream('Thomas', 'How much PTO do I have?')
+            await chunks.__anext__()
+            await chunks.aclose()
+            return self.system._api_slots._value
+
+        self.assertEqual(asyncio.run(disconnect_after_first_chunk()), agent.MAX_CONCURRENT_REQUESTS)
+
+    def test_a_slow_reader_does_not_hold_the_api_slot(self):
+        pto = {'employee_id': 'EID2480002'}
+        completions = FakeCompletions([
+            _message(tool_calls=[_tool_call('c1', 'get_pto_balance', pto)]),
+            _message('You have 13 PTO days.'),
+        ])
+        agent.client = SimpleNamespace(chat=SimpleNamespace(completions=completions))
+
+        async def pause_after_first_chunk():
+            chunks = self.system.chat_stream('Thomas', 'How much PTO do I have?')
+            await chunks.__anext__()
+            free = self.system._api_slots._value  # the caller has not asked for more yet
+            async for _ in chunks:
+                pass
+            return free
+
+        self.assertEqual(asyncio.run(pause_after_first_chunk()), agent.MAX_CONCURRENT_REQUESTS)
+
+
+class ReplyCacheTest(AgentTestCase):
+
+    def test_yes_to_different_offers_is_not_answered_from_cache(self):
+        pto = {'employee_id': 'EID2480002'}
+        replies, calls = self.run_chat(
+            [
+                _message('Want me to check your PTO balance?'),
+                _message(tool_calls=[_tool_call('c1', 'get_pto_balance', pto)]),
+                _message('You have 13 PTO days.'),
+                _message('Want me to list the health plans?'),
+                _message(tool_calls=[_tool_call('c2', 'get_health_insurance_plans', {})]),
+                _message('Here are the health plans.'),
+            ],
+            ['pto?', 'yes', 'plans?', 'Yes'],
+        )
+        self.assertEqual(replies[3], 'Here are the health plans.')
+        self.assertEqual(calls, 6)
+
+    def test_repeated_question_in_same_context_is_cached(self):
+        pto = {'employee_id': 'EID2480002'}
+        replies, calls = self.run_chat(
+            [
+                _message(tool_calls=[_tool_call('c1', 'get_pto_balance', pto)]),
+                _message('You have 13 PTO days.'),
+                _message(tool_calls=[_tool_call('c2', 'get_pto_balance', pto)]),
+                _message('You have 13 PTO days.'),
+            ],
+            ['How much PTO do I have?'] * 3,
+        )
+        self.assertEqual(replies, ['You have 13 PTO days.'] * 3)
+        self.assertEqual(calls, 4)  # the third ask follows the same reply as the second
+
+    def test_short_follow_up_after_a_different_reply_is_not_cached(self):
+        replies, calls = self.run_chat(
+            [
+                _message(tool_calls=[_tool_call('c1', 'get_health_insurance_plans', {})]),
+                _message('The PPO costs $200 a month.'),
+                _message(tool_calls=[_tool_call('c2', 'get_health_insurance_plans', {})]),
+                _message('PPO family coverage is $500.'),
+                _message(tool_calls=[_tool_call('c3', 'get_health_insurance_plans', {})]),
+                _message('The HMO costs $100 a month.'),
+                _message(tool_calls=[_tool_call('c4', 'get_health_insurance_plans', {})]),
+                _message('HMO family coverage is $300.'),
+            ],
+            ['What does the PPO cost?', 'and family?', 'What does the HMO cost?', 'and family?'],
+        )
+        self.assertEqual(replies[3], 'HMO family coverage is $300.')
+        self.assertEqual(calls, 8)
+
+
+    def test_long_follow_up_after_a_different_reply_is_not_cached(self):
+        replies, calls = self.run_chat(
+            [
+                _message(tool_calls=[_tool_call('c1', 'get_health_insurance_plans', {})]),
+                _message('The PPO costs $200 a month.'),
+                _message(tool_calls=[_tool_call('c2', 'get_health_insurance_plans', {})]),
+                _message('PPO family is $500.'),
+                _message(tool_calls=[_tool_call('c3', 'get_health_insurance_plans', {})]),
+                _message('The HMO costs $100 a month.'),
+                _message(tool_calls=[_tool_call('c4', 'get_health_insurance_plans', {})]),
+                _message('HMO family is $300.'),
+            ],
+            ['What does the PPO cost?', 'what about family coverage?',
+             'What does the HMO cost?', 'what about family coverage?'],
+        )
+        self.assertEqual(replies[3], 'HMO family is $300.')
+        self.assertEqual(calls, 8)
+
+if __name__ == '__main__':
+    unittest.main()